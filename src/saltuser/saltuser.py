@@ -1,4 +1,189 @@
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+
 import pandas as pd
+import sqlalchemy
+
+
+class _TTLCache:
+    """
+    A thread-safe cache whose entries expire after a given time.
+
+    If the cache is full, the least recently added entry is discarded.
+
+    Parameters
+    ----------
+    maxsize : int
+        The maximum number of entries.
+    ttl : float
+        The time (in seconds) after which an entry expires.
+
+    """
+
+    def __init__(self, maxsize, ttl):
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Get the value for a key, or a default if there is no unexpired entry.
+
+        Parameters
+        ----------
+        key : hashable
+            The key.
+        default : object
+            The value to return if there is no unexpired entry for the key.
+
+        Returns
+        -------
+        object
+            The cached value, or the default.
+
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return default
+            return value
+
+    def __setitem__(self, key, value):
+        """
+        Set the value for a key.
+
+        The entry expires after the cache's time-to-live. If the cache is full
+        afterwards, the least recently added entries are discarded.
+
+        Parameters
+        ----------
+        key : hashable
+            The key.
+        value : object
+            The value.
+
+        """
+
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.monotonic() + self._ttl, value)
+            while len(self._entries) > self._maxsize:
+                self._entries.popitem(last=False)
+
+    def pop_where(self, predicate):
+        """
+        Remove the entries whose key fulfils a condition.
+
+        Parameters
+        ----------
+        predicate : callable
+            A function which takes a key and returns whether its entry should be
+            removed.
+
+        """
+
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                del self._entries[key]
+
+    def clear(self):
+        """
+        Remove all entries.
+
+        """
+
+        with self._lock:
+            self._entries.clear()
+
+
+# SQLAlchemy engines created for database URIs, so that connections are pooled
+_engines = {}
+_engines_lock = threading.Lock()
+
+# Partners represented on proposals and TAC partners of users, shared by all users
+# and keyed by database and proposal code or user id. This trades strict freshness
+# for latency; use SALTUser.invalidate_cache to discard stale entries.
+_proposal_partners_cache = _TTLCache(maxsize=4096, ttl=300)
+_tac_partners_cache = _TTLCache(maxsize=4096, ttl=300)
+
+
+def _database_key(db_connectable):
+    """
+    Get a key identifying the database of a connectable.
+
+    The key is used for distinguishing databases in the caches shared by all users.
+
+    Parameters
+    ----------
+    db_connectable : SQLAlchemy connectable(engine/connection) or DB-API connection
+        A connection to the database.
+
+    Returns
+    -------
+    hashable or None
+        The key, or None if the database cannot be identified. In the latter case
+        the shared caches must not be used.
+
+    """
+
+    # SQLAlchemy engines and connections have an engine with the database URL
+    engine = getattr(db_connectable, "engine", None)
+    if engine is not None and hasattr(engine, "url"):
+        return str(engine.url)
+
+    # A weak reference only equals a reference to the same (live) connection, so
+    # entries for a garbage-collected connection can't be used for a new one.
+    try:
+        return weakref.ref(db_connectable)
+    except TypeError:
+        return None
+
+
+def _connectable(db_connectable):
+    """
+    Get the SQLAlchemy connectable to use for a database connection or URI.
+
+    If a database URI is passed, a (pooled) SQLAlchemy engine is returned for it. The
+    same engine is reused for all users with the same URI. The pool size is only set
+    if the pool used for the URI supports it. Any other connectable is returned
+    unchanged.
+
+    Parameters
+    ----------
+    db_connectable : SQLAlchemy connectable(engine/connection) or database string URI
+        A connection to the database to use, or its URI.
+
+    Returns
+    -------
+    SQLAlchemy connectable(engine/connection)
+        The connectable.
+
+    """
+
+    if not isinstance(db_connectable, str):
+        return db_connectable
+
+    with _engines_lock:
+        if db_connectable not in _engines:
+            try:
+                engine = sqlalchemy.create_engine(
+                    db_connectable, pool_size=10, max_overflow=20, pool_pre_ping=True
+                )
+            except TypeError:
+                # the pool used for the URI (such as SQLite's) has no size limits
+                engine = sqlalchemy.create_engine(db_connectable, pool_pre_ping=True)
+            _engines[db_connectable] = engine
+
+        return _engines[db_connectable]
 
 
 class SALTUser:
@@ -14,8 +199,11 @@ class SALTUser:
     A new user should be created using either the constructor or the
     :meth:`find_by_username` method.
 
-    You need to specify a database connection when creating the user. Any format allowed
-    by the `con` parameter of pandas' `read_sql` function can be used.
+    You need to specify a database connection when creating the user. This may be a
+    SQLAlchemy engine or connection, a DB-API connection or a database URI. If a
+    database URI is given, a pooled SQLAlchemy engine is created for it and shared by
+    all users with the same URI. Pass an engine yourself if you need control over the
+    pooling.
 
     Parameters
     ----------
@@ -31,29 +219,82 @@ class SALTUser:
 
     """
 
+    __slots__ = (
+        "_db_connectable",
+        "_user_id",
+        "_given_name",
+        "_family_name",
+        "_email",
+        "_is_admin",
+        "_is_board_member",
+        "_tac_member_partners",
+        "_tac_chair_partners",
+        "_perm_cache",
+        "_block_to_proposal_cache",
+    )
+
     def __init__(self, user_id, db_connectable):
+        db_connectable = _connectable(db_connectable)
+
         # sanity check: does the user exist?
-        sql = """
-SELECT pu.PiptUser_Id, FirstName, Surname, Email
-       FROM PiptUser AS pu
-       JOIN Investigator AS i USING (Investigator_Id)
-       WHERE pu.PiptUser_Id=%(user_id)s
-"""
-        df = pd.read_sql(sql, con=db_connectable, params=dict(user_id=user_id))
-        if len(df) == 0:
+        row = SALTUser._load_user_row("PiptUser_Id", user_id, db_connectable)
+        if row is None:
             raise ValueError(
                 "There is no user with id {user_id}.".format(user_id=user_id)
             )
 
+        self._init_from_row(row, db_connectable)
+
+    @classmethod
+    def _from_row(cls, row, db_connectable):
+        """
+        Create a user from an already fetched user row.
+
+        Parameters
+        ----------
+        row : dict
+            The user row, as returned by :meth:`_load_user_row`.
+        db_connectable : SQLAlchemy connectable(engine/connection)
+            A connection to the database to use. Database URIs must have been resolved
+            with :func:`_connectable` already.
+
+        Returns
+        -------
+        SALTUser
+            The SALT user.
+
+        """
+
+        user = cls.__new__(cls)
+        user._init_from_row(row, db_connectable)
+
+        return user
+
+    def _init_from_row(self, row, db_connectable):
+        """
+        Initialise the user from a user row.
+
+        Parameters
+        ----------
+        row : dict
+            The user row, as returned by :meth:`_load_user_row`.
+        db_connectable : SQLAlchemy connectable(engine/connection)
+            A connection to the database to use. Database URIs must have been resolved
+            with :func:`_connectable` already.
+
+        """
+
         self._db_connectable = db_connectable
-        self._user_id = user_id
-        self._given_name = df["FirstName"][0]
-        self._family_name = df["Surname"][0]
-        self._email = df["Email"][0]
-        self._is_board_member = None
-        self._tac_member_partners = self._find_tac_member_partners()
-        self._tac_chair_partners = self._find_tac_chair_partners()
-        self._viewable_proposals_cache = None
+        self._user_id = int(row["PiptUser_Id"])
+        self._given_name = row["FirstName"]
+        self._family_name = row["Surname"]
+        self._email = row["Email"]
+        self._is_admin = bool(row["Is_Admin"])
+        self._is_board_member = bool(row["Is_Board_Member"])
+        self._tac_member_partners = None
+        self._tac_chair_partners = None
+        self._perm_cache = {}
+        self._block_to_proposal_cache = {}
 
     @staticmethod
     def verify(username, password, db_connectable):
@@ -83,7 +324,9 @@ SELECT PiptUser_Id AS UserCount
        WHERE Username=%(username)s AND Password=MD5(%(password)s)
         """
         df = pd.read_sql(
-            sql, con=db_connectable, params=dict(username=username, password=password)
+            sql,
+            con=_connectable(db_connectable),
+            params=dict(username=username, password=password),
         )
         if len(df) == 0:
             raise ValueError("invlid username or password")
@@ -113,9 +356,41 @@ SELECT PiptUser_Id AS UserCount
 
         """
 
-        user_id = SALTUser._find_user_id(username, db_connectable)
+        db_connectable = _connectable(db_connectable)
+        row = SALTUser._load_user_row("Username", username, db_connectable)
+
+        # sanity check: does the user exist?
+        if row is None:
+            raise ValueError(
+                "The username does not exist: {username}".format(username=username)
+            )
+
+        return SALTUser._from_row(row, db_connectable)
+
+    @classmethod
+    def invalidate_cache(cls, user_id=None):
+        """
+        Discard the cached data shared by all users.
+
+        Some data which rarely changes, such as the partners represented on a
+        proposal or the TACs of a user, is cached for a few minutes for all users.
+        This method should be called after such data has been changed.
+
+        Parameters
+        ----------
+        user_id : int, optional
+            The id of a user. If given, only the cached TACs of this user are
+            discarded (for all databases).
+
+        """
+
+        if user_id is not None:
+            user_id = int(user_id)
+            _tac_partners_cache.pop_where(lambda key: key[1] == user_id)
+            return
 
-        return SALTUser(user_id, db_connectable)
+        _proposal_partners_cache.clear()
+        _tac_partners_cache.clear()
 
     @property
     def given_name(self):
@@ -170,16 +445,7 @@ SELECT PiptUser_Id AS UserCount
 
         """
 
-        sql = """
-SELECT Value
-       FROM PiptUserSetting as pus
-       JOIN PiptSetting ps on pus.PiptSetting_Id = ps.PiptSetting_Id
-       JOIN PiptUser AS pu ON pus.PiptUser_Id = pu.PiptUser_Id
-       WHERE pu.PiptUser_Id=%(user_id)s AND PiptSetting_Name='RightAdmin'
-        """
-        df = self._query(sql, params=dict(user_id=self._user_id))
-
-        return len(df) > 0 and int(df["Value"][0], 10) > 0
+        return self._is_admin
 
     def is_investigator(self, proposal_code):
         """
@@ -197,18 +463,23 @@ SELECT Value
 
         """
 
-        sql = """
-SELECT COUNT(*) AS User_Count
-       FROM ProposalCode AS pc
-       JOIN ProposalInvestigator pi on pc.ProposalCode_Id = pi.ProposalCode_Id
-       JOIN Investigator AS i ON pi.Investigator_Id = i.Investigator_Id
-       WHERE Proposal_Code=%(proposal_code)s AND PiptUser_Id=%(user_id)s
-        """
-        df = self._query(
-            sql, params=dict(proposal_code=proposal_code, user_id=self._user_id)
-        )
+        key = ("is_investigator", proposal_code)
+        if key not in self._perm_cache:
+            sql = """
+SELECT EXISTS(SELECT 1
+                     FROM ProposalCode AS pc
+                     JOIN ProposalInvestigator pi
+                          ON pc.ProposalCode_Id = pi.ProposalCode_Id
+                     JOIN Investigator AS i ON pi.Investigator_Id = i.Investigator_Id
+                     WHERE Proposal_Code=%(proposal_code)s
+                           AND PiptUser_Id=%(user_id)s) AS Is_Investigator
+            """
+            row = self._scalar(
+                sql, params=dict(proposal_code=proposal_code, user_id=self._user_id)
+            )
+            self._perm_cache[key] = bool(row[0])
 
-        return df["User_Count"][0] > 0
+        return self._perm_cache[key]
 
     def is_principal_investigator(self, proposal_code):
         """
@@ -226,18 +497,7 @@ SELECT COUNT(*) AS User_Count
 
         """
 
-        sql = """
-SELECT COUNT(*) AS User_Count
-       FROM ProposalContact AS pco
-       JOIN Investigator AS i ON pco.Leader_Id=i.Investigator_Id
-       JOIN ProposalCode AS pc ON pco.ProposalCode_Id = pc.ProposalCode_Id
-       WHERE Proposal_Code=%(proposal_code)s AND PiptUser_Id=%(user_id)s
-        """
-        df = self._query(
-            sql, params=dict(proposal_code=proposal_code, user_id=self._user_id)
-        )
-
-        return df["User_Count"][0] > 0
+        return self._proposal_roles(proposal_code)[0]
 
     def is_principal_contact(self, proposal_code):
         """
@@ -255,18 +515,7 @@ SELECT COUNT(*) AS User_Count
 
         """
 
-        sql = """
-SELECT COUNT(*) AS User_Count
-       FROM ProposalContact AS pco
-       JOIN Investigator AS i ON pco.Contact_Id=i.Investigator_Id
-       JOIN ProposalCode AS pc ON pco.ProposalCode_Id = pc.ProposalCode_Id
-       WHERE Proposal_Code=%(proposal_code)s AND PiptUser_Id=%(user_id)s
-        """
-        df = self._query(
-            sql, params=dict(proposal_code=proposal_code, user_id=self._user_id)
-        )
-
-        return df["User_Count"][0] > 0
+        return self._proposal_roles(proposal_code)[1]
 
     def is_board_member(self):
         """
@@ -278,20 +527,6 @@ SELECT COUNT(*) AS User_Count
             Whether the user is a Board member.
         """
 
-        if self._is_board_member is None:
-            sql = """
-SELECT *
-       FROM PiptUserSetting
-       WHERE PiptUser_Id=%(user_id)s
-             AND PiptSetting_Id=
-                     (SELECT PiptSetting_Id
-                             FROM PiptSetting
-                             WHERE PiptSetting_Name='RightBoard')
-             AND Value>0
-            """
-            df = self._query(sql, dict(user_id=self._user_id))
-            self._is_board_member = len(df) > 0
-
         return self._is_board_member
 
     def is_tac_member(self, partner_code=None):
@@ -314,9 +549,9 @@ SELECT *
         """
 
         if not partner_code:
-            return len(self._tac_member_partners)
+            return len(self._tac_members)
 
-        return partner_code in self._tac_member_partners
+        return partner_code in self._tac_members
 
     def is_proposal_tac_member(self, proposal_code):
         """
@@ -334,13 +569,8 @@ SELECT *
 
         """
 
-        return (
-            len(
-                set(self._tac_member_partners).intersection(
-                    self._proposal_partners(proposal_code)
-                )
-            )
-            > 0
+        return not self._tac_members.isdisjoint(
+            self._proposal_partners(proposal_code)
         )
 
     @property
@@ -354,7 +584,7 @@ SELECT *
             The partner codes of the TACs.
         """
 
-        return self._tac_member_partners
+        return list(self._tac_members)
 
     def is_tac_chair(self, partner_code=None):
         """
@@ -376,9 +606,9 @@ SELECT *
         """
 
         if not partner_code:
-            return len(self._tac_chair_partners)
+            return len(self._tac_chairs)
 
-        return partner_code in self._tac_chair_partners
+        return partner_code in self._tac_chairs
 
     def may_view_proposal(self, proposal_code):
         """
@@ -395,23 +625,68 @@ SELECT *
 
         """
 
-        return proposal_code in self._viewable_proposals
+        return self._can_view_single(proposal_code)
 
-    @property
-    def _viewable_proposals(self):
+    def _can_view_single(self, proposal_code):
         """
-        The proposals (as a list of proposal codes) the user may view.
+        Check whether the user may view a given proposal, without finding all the
+        proposals the user may view.
+
+        The result is cached.
+
+        Parameters
+        ----------
+        proposal_code : str
+            The proposal code.
 
         Returns
         -------
-        list of str
-            The list of proposal codes.
+        bool
+            Whether the user may view the proposal.
+
         """
 
-        if self._viewable_proposals_cache is not None:
-            return self._viewable_proposals_cache
+        key = ("may_view_proposal", proposal_code)
+        if key not in self._perm_cache:
+            self._perm_cache[key] = any(
+                self._query_column(sql, params=params)
+                for sql, params in self._viewable_proposals_queries(
+                    proposal_codes=[proposal_code]
+                )
+            )
 
-        sql = """
+        return self._perm_cache[key]
+
+    def _viewable_proposals_queries(self, proposal_codes):
+        """
+        Get the SQL queries and parameters for finding the proposals the user may
+        view.
+
+        Rather than using a single query with all the conditions, there is a separate
+        query for each reason why the user may view a proposal, and only the queries
+        relevant for the user are returned. Administrators and Board members may
+        view all proposals, so for them there is just one query. Otherwise there is a
+        query for the proposals on which the user is an investigator and, if the user
+        is member of a TAC, one for the proposals requesting time from their TACs.
+
+        All queries use the same joins as a single query with all the conditions
+        would, so that only proposals with an investigator who has a PIPT user account
+        and with time requests for a semester are viewable. Each query returns the
+        distinct proposal codes.
+
+        Parameters
+        ----------
+        proposal_codes : list of str
+            Proposal codes. The queries only return proposals among these.
+
+        Returns
+        -------
+        list of tuple
+            The SQL queries and their parameters.
+
+        """
+
+        sql_template = """
 SELECT DISTINCT Proposal_Code
        FROM ProposalCode AS pc
        JOIN ProposalInvestigator AS pi ON pc.ProposalCode_Id = pi.ProposalCode_Id
@@ -421,23 +696,56 @@ SELECT DISTINCT Proposal_Code
        JOIN MultiPartner AS mp ON pc.ProposalCode_Id = mp.ProposalCode_Id
                                   AND p.Semester_Id = mp.Semester_Id
        JOIN Partner AS partner ON mp.Partner_Id = partner.Partner_Id
-       WHERE pu.PiptUser_Id=%(user_id)s
-             OR (partner.Partner_Code IN %(tacs)s AND mp.ReqTimeAmount>0)
-             OR (1=%(is_admin)s)
-             OR (1=%(is_board_member)s)
-"""
-        df = self._query(
-            sql,
-            params=dict(
-                user_id=self._user_id,
-                tacs=self.tacs if self.tacs else ["IMPOSSIBLE_VALUE"],
-                is_admin=1 if self.is_admin() else 0,
-                is_board_member=1 if self.is_board_member() else 0,
-            ),
-        )
+       {where}
+        """
 
-        self._viewable_proposals_cache = set(df["Proposal_Code"].tolist())
-        return self._viewable_proposals_cache
+        # each query is given by its WHERE conditions and its parameters
+        queries = []
+        if self.is_admin() or self.is_board_member():
+            queries.append(([], dict()))
+        else:
+            queries.append(
+                (["pu.PiptUser_Id=%(user_id)s"], dict(user_id=self._user_id))
+            )
+            if self._tac_members:
+                queries.append(
+                    (
+                        ["partner.Partner_Code IN %(tacs)s", "mp.ReqTimeAmount>0"],
+                        dict(tacs=self.tacs),
+                    )
+                )
+
+        for conditions, params in queries:
+            conditions.append("pc.Proposal_Code IN %(proposal_codes)s")
+            params["proposal_codes"] = list(proposal_codes)
+
+        return [
+            (SALTUser._with_where_clause(sql_template, conditions), params)
+            for conditions, params in queries
+        ]
+
+    @staticmethod
+    def _with_where_clause(sql_template, conditions):
+        """
+        Add a WHERE clause to an SQL query.
+
+        Parameters
+        ----------
+        sql_template : str
+            The SQL query, with a ``{where}`` placeholder for the WHERE clause.
+        conditions : list of str
+            The conditions, which must all be fulfilled.
+
+        Returns
+        -------
+        str
+            The SQL query.
+
+        """
+
+        return sql_template.format(
+            where="WHERE " + "\n             AND ".join(conditions)
+        )
 
     def may_edit_proposal(self, proposal_code):
         """
@@ -455,11 +763,10 @@ SELECT DISTINCT Proposal_Code
 
         """
 
-        return (
-            self.is_principal_investigator(proposal_code)
-            or self.is_principal_contact(proposal_code)
-            or self.is_admin()
-        )
+        if self.is_admin():
+            return True
+
+        return any(self._proposal_roles(proposal_code))
 
     def may_view_block(self, block_id):
         """
@@ -511,6 +818,72 @@ SELECT DISTINCT Proposal_Code
 
         return self.may_edit_proposal(proposal_code=proposal_code)
 
+    def may_view_blocks(self, block_ids):
+        """
+        Check whether the user may view given blocks.
+
+        Parameters
+        ----------
+        block_ids : iterable of int
+            The block ids.
+
+        Returns
+        -------
+        dict
+            A dictionary of the block ids (as int) and whether the user may view the
+            corresponding block.
+
+        Raises
+        ------
+        ValueError
+            If there exists no block for any of the given block ids.
+
+        """
+
+        proposal_codes = self._proposal_codes_of_blocks(block_ids=block_ids)
+        viewable_proposals = self._viewable_proposals_among(
+            set(proposal_codes.values())
+        )
+
+        return {
+            block_id: proposal_code in viewable_proposals
+            for block_id, proposal_code in proposal_codes.items()
+        }
+
+    def may_edit_blocks(self, block_ids):
+        """
+        Check whether the user may edit given blocks.
+
+        Parameters
+        ----------
+        block_ids : iterable of int
+            The block ids.
+
+        Returns
+        -------
+        dict
+            A dictionary of the block ids (as int) and whether the user may edit the
+            corresponding block.
+
+        Raises
+        ------
+        ValueError
+            If there exists no block for any of the given block ids.
+
+        """
+
+        proposal_codes = self._proposal_codes_of_blocks(block_ids=block_ids)
+
+        if self.is_admin():
+            return {block_id: True for block_id in proposal_codes}
+
+        self._load_proposal_roles(set(proposal_codes.values()))
+
+        return {
+            block_id: self.may_edit_proposal(proposal_code=proposal_code)
+            for block_id, proposal_code in proposal_codes.items()
+        }
+
     def _proposal_code_of_block(self, block_id):
         """
         Get the proposal code of the proposal containing a given block.
@@ -532,28 +905,222 @@ SELECT DISTINCT Proposal_Code
 
         """
 
-        sql = """
+        block_id = int(block_id)
+        if block_id not in self._block_to_proposal_cache:
+            sql = """
 SELECT Proposal_Code
        FROM ProposalCode AS pc
        JOIN Block AS b ON pc.ProposalCode_Id = b.ProposalCode_Id
        WHERE Block_Id=%(block_id)s
+            """
+            row = self._scalar(sql, params=dict(block_id=block_id))
+
+            # sanity check: does the block exist?
+            if row is None:
+                raise ValueError(
+                    "There exists no block with id {block_id}".format(
+                        block_id=block_id
+                    )
+                )
+
+            self._block_to_proposal_cache[block_id] = row[0]
+
+        return self._block_to_proposal_cache[block_id]
+
+    def _proposal_codes_of_blocks(self, block_ids):
         """
-        df = self._query(sql, params=dict(block_id=block_id))
+        Get the proposal codes of the proposals containing given blocks.
 
-        # sanity check: does the block exist?
-        if len(df) == 0:
+        Parameters
+        ----------
+        block_ids : iterable of int
+            The block ids.
+
+        Returns
+        -------
+        dict
+            A dictionary of the block ids (as int) and the corresponding proposal
+            codes.
+
+        Raises
+        ------
+        ValueError
+            If there exists no block for any of the given block ids.
+
+        """
+
+        block_ids = {int(block_id) for block_id in block_ids}
+        uncached_block_ids = block_ids.difference(self._block_to_proposal_cache)
+
+        if uncached_block_ids:
+            sql = """
+SELECT Block_Id, Proposal_Code
+       FROM ProposalCode AS pc
+       JOIN Block AS b ON pc.ProposalCode_Id = b.ProposalCode_Id
+       WHERE Block_Id IN %(block_ids)s
+            """
+            with SALTUser._cursor(self._db_connectable) as cursor:
+                cursor.execute(sql, dict(block_ids=list(uncached_block_ids)))
+                for block_id, proposal_code in cursor.fetchall():
+                    self._block_to_proposal_cache[int(block_id)] = proposal_code
+
+        # sanity check: do all the blocks exist?
+        missing_block_ids = block_ids.difference(self._block_to_proposal_cache)
+        if missing_block_ids:
             raise ValueError(
-                "There exists no block with id {block_id}".format(block_id=block_id)
+                "There exist no blocks with ids {block_ids}".format(
+                    block_ids=", ".join(str(b) for b in sorted(missing_block_ids))
+                )
             )
 
-        return df["Proposal_Code"][0]
+        return {
+            block_id: self._block_to_proposal_cache[block_id] for block_id in block_ids
+        }
 
-    def _query(self, sql, params):
+    def _viewable_proposals_among(self, proposal_codes):
         """
-        Query the database.
+        Find the proposals the user may view among given proposals.
 
-        Depending on how they are referenced in the SQL query, the query parameters must
-        be passed as an iterable or as a dict.
+        Only the given proposals are queried, and the results are cached for
+        :meth:`may_view_proposal`.
+
+        Parameters
+        ----------
+        proposal_codes : set of str
+            The proposal codes.
+
+        Returns
+        -------
+        set of str
+            The proposal codes of the proposals the user may view.
+
+        """
+
+        uncached_proposal_codes = [
+            proposal_code
+            for proposal_code in proposal_codes
+            if ("may_view_proposal", proposal_code) not in self._perm_cache
+        ]
+
+        if uncached_proposal_codes:
+            viewable_proposals = set()
+            for sql, params in self._viewable_proposals_queries(
+                proposal_codes=uncached_proposal_codes
+            ):
+                viewable_proposals.update(self._query_column(sql, params=params))
+            for proposal_code in uncached_proposal_codes:
+                self._perm_cache[("may_view_proposal", proposal_code)] = (
+                    proposal_code in viewable_proposals
+                )
+
+        return {
+            proposal_code
+            for proposal_code in proposal_codes
+            if self._perm_cache[("may_view_proposal", proposal_code)]
+        }
+
+    def _load_proposal_roles(self, proposal_codes):
+        """
+        Find the roles relevant for editing given proposals.
+
+        The Principal Investigator and Principal Contact roles are checked with a
+        single query for all the proposals whose roles haven't been cached yet, and
+        the results are cached for :meth:`_proposal_roles`.
+
+        Parameters
+        ----------
+        proposal_codes : set of str
+            The proposal codes.
+
+        """
+
+        uncached_proposal_codes = [
+            proposal_code
+            for proposal_code in proposal_codes
+            if ("proposal_roles", proposal_code) not in self._perm_cache
+        ]
+        if not uncached_proposal_codes:
+            return
+
+        sql = """
+SELECT Proposal_Code,
+       MAX(li.PiptUser_Id=%(user_id)s) AS Is_PI,
+       MAX(ci.PiptUser_Id=%(user_id)s) AS Is_PC
+       FROM ProposalContact AS pco
+       JOIN ProposalCode AS pc ON pco.ProposalCode_Id = pc.ProposalCode_Id
+       LEFT JOIN Investigator AS li ON pco.Leader_Id=li.Investigator_Id
+       LEFT JOIN Investigator AS ci ON pco.Contact_Id=ci.Investigator_Id
+       WHERE Proposal_Code IN %(proposal_codes)s
+       GROUP BY Proposal_Code
+        """
+        with SALTUser._cursor(self._db_connectable) as cursor:
+            cursor.execute(
+                sql,
+                dict(proposal_codes=uncached_proposal_codes, user_id=self._user_id),
+            )
+            rows = cursor.fetchall()
+
+        roles = {
+            proposal_code: (bool(is_pi), bool(is_pc))
+            for proposal_code, is_pi, is_pc in rows
+        }
+        for proposal_code in uncached_proposal_codes:
+            is_pi, is_pc = roles.get(proposal_code, (False, False))
+            self._perm_cache[("proposal_roles", proposal_code)] = (
+                is_pi,
+                is_pc,
+                self.is_admin(),
+            )
+
+    def _proposal_roles(self, proposal_code):
+        """
+        Find the roles relevant for editing a given proposal.
+
+        The Principal Investigator and Principal Contact roles are checked with a
+        single query, and the result is cached.
+
+        Parameters
+        ----------
+        proposal_code : str
+            The proposal code.
+
+        Returns
+        -------
+        tuple of bool
+            Whether the user is the Principal Investigator of the proposal, whether
+            they are its Principal Contact and whether they are an administrator.
+
+        """
+
+        key = ("proposal_roles", proposal_code)
+        if key not in self._perm_cache:
+            sql = """
+SELECT EXISTS(SELECT 1
+                     FROM ProposalContact AS pco
+                     JOIN Investigator AS i ON pco.Leader_Id=i.Investigator_Id
+                     JOIN ProposalCode AS pc ON pco.ProposalCode_Id = pc.ProposalCode_Id
+                     WHERE Proposal_Code=%(proposal_code)s
+                           AND i.PiptUser_Id=%(user_id)s) AS Is_PI,
+       EXISTS(SELECT 1
+                     FROM ProposalContact AS pco
+                     JOIN Investigator AS i ON pco.Contact_Id=i.Investigator_Id
+                     JOIN ProposalCode AS pc ON pco.ProposalCode_Id = pc.ProposalCode_Id
+                     WHERE Proposal_Code=%(proposal_code)s
+                           AND i.PiptUser_Id=%(user_id)s) AS Is_PC
+            """
+            row = self._scalar(
+                sql, params=dict(proposal_code=proposal_code, user_id=self._user_id)
+            )
+            self._perm_cache[key] = (bool(row[0]), bool(row[1]), self.is_admin())
+
+        return self._perm_cache[key]
+
+    def _scalar(self, sql, params):
+        """
+        Query the database for a single row.
+
+        A DB-API cursor is used directly, avoiding the overhead of creating a pandas
+        data frame.
 
         Parameters
         ----------
@@ -564,55 +1131,149 @@ SELECT Proposal_Code
 
         Returns
         -------
-        DataFrame
-            A pandas data frame with the query results.
+        tuple or None
+            The first row of the query results, or None if there are no results.
 
         """
 
-        return pd.read_sql(sql, con=self._db_connectable, params=params)
+        with SALTUser._cursor(self._db_connectable) as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchone()
 
-    @staticmethod
-    def _find_user_id(username, db_connectable):
+    def _query_column(self, sql, params):
         """
-        Find the user id corresponding to a username.
+        Query the database for the values of a single column.
+
+        As with :meth:`_scalar`, a DB-API cursor is used directly, avoiding the
+        overhead of creating a pandas data frame.
 
         Parameters
         ----------
-        username : str
-            The username.
-        db_connectable : SQLAlchemy connectable(engine/connection) or database string
-                         URI
-            A connection to the database to use, or its URI.
+        sql : str
+            The SQL query. Only the first column of its results is used.
+        params : iterable or dict
+            The query parameters.
 
         Returns
         -------
-        int
-            The user id.
+        set
+            The distinct values of the first column of the query results.
 
-        Raises
+        """
+
+        with SALTUser._cursor(self._db_connectable) as cursor:
+            cursor.execute(sql, params)
+            return {row[0] for row in cursor.fetchall()}
+
+    @staticmethod
+    @contextmanager
+    def _cursor(db_connectable):
+        """
+        Get a DB-API cursor for a database.
+
+        If the database connectable is an engine, a raw connection is acquired for the
+        cursor and released again afterwards. An existing connection is reused and left
+        open.
+
+        Parameters
+        ----------
+        db_connectable : SQLAlchemy connectable(engine/connection)
+            A connection to the database to use.
+
+        Yields
         ------
-        ValueError
-            If the username does not exist.
+        cursor
+            The DB-API cursor.
 
         """
 
-        sql = """
-SELECT PiptUser_Id FROM PiptUser WHERE Username=%(username)s
+        connectable = db_connectable
+        if hasattr(connectable, "raw_connection"):
+            # SQLAlchemy engine
+            connection = connectable.raw_connection()
+            close_connection = True
+        elif hasattr(connectable, "cursor"):
+            # DB-API connection
+            connection = connectable
+            close_connection = False
+        else:
+            # SQLAlchemy connection
+            connection = connectable.connection
+            close_connection = False
+
+        try:
+            cursor = connection.cursor()
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+        finally:
+            if close_connection:
+                connection.close()
+
+    @staticmethod
+    def _load_user_row(key, value, db_connectable):
         """
-        df = pd.read_sql(sql, con=db_connectable, params=dict(username=username))
+        Load the details of the user identified by a user id or username.
 
-        # sanity check: does the user exist?
-        if len(df) == 0:
-            raise ValueError(
-                "The username does not exist: {username}".format(username=username)
-            )
+        The admin and Board member rights are loaded with the same query. The TACs
+        are only loaded when needed.
+
+        Parameters
+        ----------
+        key : {'PiptUser_Id', 'Username'}
+            The column identifying the user.
+        value : int or str
+            The user id or username.
+        db_connectable : SQLAlchemy connectable(engine/connection)
+            A connection to the database to use.
+
+        Returns
+        -------
+        dict or None
+            The user id, given name, family name, email address and admin and Board
+            member flags of the user, or None if there is no such user.
+
+        """
+
+        if key not in ("PiptUser_Id", "Username"):
+            raise ValueError("Unsupported key for identifying a user: " + key)
+
+        sql = """
+SELECT pu.PiptUser_Id, FirstName, Surname, Email,
+       EXISTS(SELECT 1
+                     FROM PiptUserSetting AS pus
+                     JOIN PiptSetting AS ps ON pus.PiptSetting_Id = ps.PiptSetting_Id
+                     WHERE pus.PiptUser_Id=pu.PiptUser_Id
+                           AND PiptSetting_Name='RightAdmin'
+                           AND CAST(Value AS SIGNED)>0) AS Is_Admin,
+       EXISTS(SELECT 1
+                     FROM PiptUserSetting AS pus
+                     JOIN PiptSetting AS ps ON pus.PiptSetting_Id = ps.PiptSetting_Id
+                     WHERE pus.PiptUser_Id=pu.PiptUser_Id
+                           AND PiptSetting_Name='RightBoard'
+                           AND CAST(Value AS SIGNED)>0) AS Is_Board_Member
+       FROM PiptUser AS pu
+       JOIN Investigator AS i USING (Investigator_Id)
+       WHERE pu.{key}=%(value)s
+""".format(
+            key=key
+        )
+        with SALTUser._cursor(db_connectable) as cursor:
+            cursor.execute(sql, dict(value=value))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            columns = [description[0] for description in cursor.description]
 
-        return df["PiptUser_Id"][0].item()
+        return dict(zip(columns, row))
 
     def _proposal_partners(self, proposal_code):
         """
         Find the partners who are represented among a proposal's investigators.
 
+        The partners are cached for all users for a few minutes.
+
         Parameters
         ----------
         proposal_code : str
@@ -620,12 +1281,18 @@ SELECT PiptUser_Id FROM PiptUser WHERE Username=%(username)s
 
         Returns
         -------
-        list of str
-            The list of partner codes.
+        frozenset of str
+            The set of partner codes.
 
         """
 
-        sql = """
+        database_key = _database_key(self._db_connectable)
+        cache_key = (database_key, proposal_code)
+        partners = None
+        if database_key is not None:
+            partners = _proposal_partners_cache.get(cache_key)
+        if partners is None:
+            sql = """
 SELECT DISTINCT Partner_Code
        FROM Partner AS p
        JOIN Institute AS ins ON p.Partner_Id = ins.Partner_Id
@@ -633,49 +1300,80 @@ SELECT DISTINCT Partner_Code
        JOIN ProposalInvestigator pi on i.Investigator_Id = pi.Investigator_Id
        JOIN ProposalCode AS pc ON pi.ProposalCode_Id = pc.ProposalCode_Id
        WHERE Proposal_Code=%(proposal_code)s
-        """
-        df = self._query(sql, params=dict(proposal_code=proposal_code))
+            """
+            partners = frozenset(
+                self._query_column(sql, params=dict(proposal_code=proposal_code))
+            )
+            if database_key is not None:
+                _proposal_partners_cache[cache_key] = partners
 
-        return df["Partner_Code"].tolist()
+        return partners
 
-    def _find_tac_member_partners(self):
+    @property
+    def _tac_members(self):
         """
-        Find the partners of whose TACs the user is a member.
+        The partners (as a set of partner codes) of whose TACs the user is a member.
 
         Returns
         -------
-        list of str
+        frozenset of str
             The partner codes.
 
         """
 
-        sql = """
-SELECT Partner_Code
-       FROM PiptUserTAC AS putac
-       JOIN Partner AS p ON putac.Partner_Id = p.Partner_Id
-       WHERE PiptUser_Id=%(user_id)s
-        """
-        df = self._query(sql, params=dict(user_id=self._user_id))
+        if self._tac_member_partners is None:
+            self._load_tac_partners()
 
-        return [pc for pc in df["Partner_Code"].tolist()]
+        return self._tac_member_partners
 
-    def _find_tac_chair_partners(self):
+    @property
+    def _tac_chairs(self):
         """
-        Find the partners of whose TACs the user is chair.
+        The partners (as a set of partner codes) of whose TACs the user is chair.
 
         Returns
         -------
-        list of str
+        frozenset of str
             The partner codes.
 
         """
 
-        sql = """
-SELECT Partner_Code
+        if self._tac_chair_partners is None:
+            self._load_tac_partners()
+
+        return self._tac_chair_partners
+
+    def _load_tac_partners(self):
+        """
+        Find the partners of whose TACs the user is a member or chair.
+
+        Both the TAC member and the TAC chair partners are read with a single query,
+        and they are cached for all users for a few minutes.
+
+        """
+
+        database_key = _database_key(self._db_connectable)
+        cache_key = (database_key, self._user_id)
+        tac_partners = None
+        if database_key is not None:
+            tac_partners = _tac_partners_cache.get(cache_key)
+        if tac_partners is None:
+            sql = """
+SELECT Partner_Code, Chair=1 AS Is_Chair
        FROM PiptUserTAC AS putac
        JOIN Partner AS p ON putac.Partner_Id = p.Partner_Id
-       WHERE PiptUser_Id=%(user_id)s AND Chair=1
+       WHERE PiptUser_Id=%(user_id)s
             """
-        df = self._query(sql, params=dict(user_id=self._user_id))
+            with SALTUser._cursor(self._db_connectable) as cursor:
+                cursor.execute(sql, dict(user_id=self._user_id))
+                rows = cursor.fetchall()
+            tac_partners = (
+                frozenset(partner_code for partner_code, _ in rows),
+                frozenset(
+                    partner_code for partner_code, is_chair in rows if bool(is_chair)
+                ),
+            )
+            if database_key is not None:
+                _tac_partners_cache[cache_key] = tac_partners
 
-        return [pc for pc in df["Partner_Code"].tolist()]
+        self._tac_member_partners, self._tac_chair_partners = tac_partners
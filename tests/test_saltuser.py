@@ -1,5 +1,494 @@
 """Tests for `salt_user` package."""
 
+import pytest
+
+from saltuser import SALTUser
+from saltuser import saltuser as saltuser_module
+
+
+class FakeCursor:
+    """A DB-API cursor returning canned results for queries."""
+
+    def __init__(self, connection):
+        self._connection = connection
+        self._rows = []
+        self.description = None
+
+    def execute(self, sql, params):
+        self._connection.queries.append((sql, params))
+        for marker, columns, rows in self._connection.results:
+            if marker in sql:
+                self.description = [(column,) for column in columns]
+                self._rows = rows(params) if callable(rows) else rows
+                return
+        self.description = None
+        self._rows = []
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    """
+    A DB-API connection with canned query results.
+
+    The results are given as a list of tuples of a string identifying the query (it
+    must be contained in the SQL), the column names and the rows. The rows may also
+    be given as a function of the query parameters.
+
+    """
+
+    def __init__(self, results):
+        self.results = results
+        self.queries = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+
+def _query_count(connection, marker):
+    return len([sql for sql, _ in connection.queries if marker in sql])
+
+
+BLOCKS = {1: "2019-1-SCI-001", 2: "2019-1-SCI-002", 3: "2019-1-SCI-001"}
+
+
+@pytest.fixture(autouse=True)
+def clear_shared_caches():
+    SALTUser.invalidate_cache()
+    yield
+    SALTUser.invalidate_cache()
+
+
+def _user_results(
+    is_admin=0, is_board_member=0, tacs=(("RSA", 1), ("UW", 0)), viewable=None
+):
+    return [
+        (
+            "FROM PiptUser AS pu",
+            [
+                "PiptUser_Id",
+                "FirstName",
+                "Surname",
+                "Email",
+                "Is_Admin",
+                "Is_Board_Member",
+            ],
+            lambda params: [
+                (42, "Jane", "Doe", "jane@example.com", is_admin, is_board_member)
+            ]
+            if params["value"] in (42, "jdoe")
+            else [],
+        ),
+        ("FROM PiptUserTAC", ["Partner_Code", "Is_Chair"], list(tacs)),
+        ("FROM Partner AS p", ["Partner_Code"], [("RSA",), ("DC",)]),
+        (
+            "WHERE Block_Id IN",
+            ["Block_Id", "Proposal_Code"],
+            lambda params: [
+                (block_id, BLOCKS[block_id])
+                for block_id in params["block_ids"]
+                if block_id in BLOCKS
+            ],
+        ),
+        (
+            "SELECT EXISTS",
+            ["Is_PI", "Is_PC"],
+            lambda params: [
+                {"2019-1-SCI-001": (1, 0), "2019-1-SCI-003": (0, 1)}.get(
+                    params["proposal_code"], (0, 0)
+                )
+            ],
+        ),
+        (
+            "FROM ProposalContact",
+            ["Proposal_Code", "Is_PI", "Is_PC"],
+            lambda params: [
+                (proposal_code, 1, 0)
+                for proposal_code in params["proposal_codes"]
+                if proposal_code == "2019-1-SCI-001"
+            ],
+        ),
+        (
+            "SELECT DISTINCT Proposal_Code",
+            ["Proposal_Code"],
+            lambda params: [
+                (proposal_code,)
+                for proposal_code in params["proposal_codes"]
+                if proposal_code in (viewable or ["2019-1-SCI-002"])
+            ],
+        ),
+    ]
+
+
+def test_find_by_username():
+    connection = FakeConnection(_user_results())
+    user = SALTUser.find_by_username("jdoe", connection)
+
+    assert user.given_name == "Jane"
+    assert user.family_name == "Doe"
+    assert user.email == "jane@example.com"
+    assert user._user_id == 42
+    assert len(connection.queries) == 1
+    sql, params = connection.queries[0]
+    assert "pu.Username=%(value)s" in sql
+    assert params == dict(value="jdoe")
+
+
+def test_find_by_username_for_non_existing_user():
+    connection = FakeConnection(_user_results())
+
+    with pytest.raises(ValueError) as excinfo:
+        SALTUser.find_by_username("nobody", connection)
+    assert "nobody" in str(excinfo.value)
+
+
+def test_constructor_for_non_existing_user():
+    connection = FakeConnection(_user_results())
+
+    with pytest.raises(ValueError):
+        SALTUser(17, connection)
+
+
+def test_may_edit_proposal():
+    connection = FakeConnection(_user_results())
+    user = SALTUser(42, connection)
+
+    assert user.is_principal_investigator("2019-1-SCI-001")
+    assert not user.is_principal_contact("2019-1-SCI-001")
+    assert user.may_edit_proposal("2019-1-SCI-001")
+
+    assert not user.is_principal_investigator("2019-1-SCI-003")
+    assert user.is_principal_contact("2019-1-SCI-003")
+    assert user.may_edit_proposal("2019-1-SCI-003")
+
+    assert not user.is_principal_investigator("2019-1-SCI-002")
+    assert not user.is_principal_contact("2019-1-SCI-002")
+    assert not user.may_edit_proposal("2019-1-SCI-002")
+
+    # one query per proposal, shared by the role checks
+    assert _query_count(connection, "SELECT EXISTS") == 3
+
+
+def test_may_edit_proposal_for_admin():
+    connection = FakeConnection(_user_results(is_admin=1))
+    user = SALTUser(42, connection)
+    query_count = len(connection.queries)
+
+    assert user.may_edit_proposal("2019-1-SCI-002")
+    assert len(connection.queries) == query_count
+
+    # the roles are still checked if asked for explicitly
+    assert not user.is_principal_investigator("2019-1-SCI-002")
+    assert not user.is_principal_contact("2019-1-SCI-002")
+
+
+def test_may_view_blocks():
+    connection = FakeConnection(_user_results())
+    user = SALTUser(42, connection)
+
+    assert user.may_view_blocks([1, 2, 3]) == {1: False, 2: True, 3: False}
+
+
+def test_may_edit_blocks():
+    connection = FakeConnection(_user_results())
+    user = SALTUser(42, connection)
+    query_count = len(connection.queries)
+
+    assert user.may_edit_blocks([1, 2, 3]) == {1: True, 2: False, 3: True}
+    # one query for the blocks and one for the proposal roles
+    assert len(connection.queries) == query_count + 2
+
+
+def test_may_edit_blocks_for_admin():
+    connection = FakeConnection(_user_results(is_admin=1))
+    user = SALTUser(42, connection)
+    query_count = len(connection.queries)
+
+    assert user.may_edit_blocks([1, 2]) == {1: True, 2: True}
+    # only the blocks are queried
+    assert len(connection.queries) == query_count + 1
+
+
+def test_block_ids_may_be_strings():
+    connection = FakeConnection(_user_results())
+    user = SALTUser(42, connection)
+
+    assert user.may_view_blocks(["2"]) == {2: True}
+    assert user.may_edit_blocks(["1"]) == {1: True}
+
+
+def test_may_view_blocks_for_non_existing_block():
+    connection = FakeConnection(_user_results())
+    user = SALTUser(42, connection)
+
+    with pytest.raises(ValueError) as excinfo:
+        user.may_view_blocks([1, 17])
+    assert "17" in str(excinfo.value)
+
+
+def test_may_view_proposal():
+    connection = FakeConnection(_user_results())
+    user = SALTUser(42, connection)
+
+    assert user.may_view_proposal("2019-1-SCI-002")
+    assert not user.may_view_proposal("2019-1-SCI-001")
+
+    # the results are cached
+    query_count = len(connection.queries)
+    assert user.may_view_proposal("2019-1-SCI-002")
+    assert not user.may_view_proposal("2019-1-SCI-001")
+    assert len(connection.queries) == query_count
+
+
+def test_may_view_proposal_and_may_view_blocks_share_results():
+    connection = FakeConnection(_user_results())
+    user = SALTUser(42, connection)
+    user.may_view_blocks([1, 2])
+    query_count = _query_count(connection, "SELECT DISTINCT Proposal_Code")
+
+    assert user.may_view_proposal("2019-1-SCI-002")
+    assert not user.may_view_proposal("2019-1-SCI-001")
+    assert _query_count(connection, "SELECT DISTINCT Proposal_Code") == query_count
+
+
+VIEWABLE_PROPOSALS_JOINS = [
+    "JOIN ProposalInvestigator AS pi",
+    "JOIN Investigator AS i",
+    "JOIN PiptUser AS pu ON i.PiptUser_Id=pu.PiptUser_Id",
+    "JOIN Proposal AS p",
+    "JOIN MultiPartner AS mp",
+    "JOIN Partner AS partner",
+]
+
+
+def _viewable_proposals_queries(connection):
+    return [
+        (sql, params)
+        for sql, params in connection.queries
+        if "SELECT DISTINCT Proposal_Code" in sql
+    ]
+
+
+def _assert_view_checks_agree(results, proposal_codes):
+    single = SALTUser(42, FakeConnection(results))
+    bulk = SALTUser(42, FakeConnection(results))
+
+    viewable = bulk._viewable_proposals_among(set(proposal_codes))
+    for proposal_code in proposal_codes:
+        assert single.may_view_proposal(proposal_code) == (proposal_code in viewable)
+
+
+@pytest.mark.parametrize("rights", [dict(is_admin=1), dict(is_board_member=1)])
+def test_viewable_proposals_queries_for_admin_or_board_member(rights):
+    results = _user_results(viewable=["2019-1-SCI-001"], **rights)
+    connection = FakeConnection(results)
+    user = SALTUser(42, connection)
+
+    assert user.may_view_proposal("2019-1-SCI-001")
+
+    queries = _viewable_proposals_queries(connection)
+    assert len(queries) == 1
+    sql, params = queries[0]
+    for join in VIEWABLE_PROPOSALS_JOINS:
+        assert join in sql
+    assert "pu.PiptUser_Id=%(user_id)s" not in sql
+    assert "Partner_Code IN" not in sql
+    assert params == dict(proposal_codes=["2019-1-SCI-001"])
+
+    # the TACs are not needed
+    assert _query_count(connection, "FROM PiptUserTAC") == 0
+
+    _assert_view_checks_agree(results, ["2019-1-SCI-001", "2019-1-SCI-002"])
+
+
+def test_viewable_proposals_queries_for_investigator():
+    results = _user_results(tacs=[])
+    connection = FakeConnection(results)
+    user = SALTUser(42, connection)
+
+    assert not user.may_view_proposal("2019-1-SCI-001")
+
+    queries = _viewable_proposals_queries(connection)
+    assert len(queries) == 1
+    sql, params = queries[0]
+    for join in VIEWABLE_PROPOSALS_JOINS:
+        assert join in sql
+    assert "pu.PiptUser_Id=%(user_id)s" in sql
+    assert "Partner_Code IN" not in sql
+    assert params == dict(user_id=42, proposal_codes=["2019-1-SCI-001"])
+
+    _assert_view_checks_agree(results, ["2019-1-SCI-001", "2019-1-SCI-002"])
+
+
+def test_viewable_proposals_queries_for_tac_member():
+    results = _user_results(tacs=[("RSA", 0)])
+    connection = FakeConnection(results)
+    user = SALTUser(42, connection)
+
+    assert user._viewable_proposals_among({"2019-1-SCI-002"}) == {"2019-1-SCI-002"}
+
+    queries = _viewable_proposals_queries(connection)
+    assert len(queries) == 2
+    for sql, _ in queries:
+        for join in VIEWABLE_PROPOSALS_JOINS:
+            assert join in sql
+    investigator_sql, investigator_params = queries[0]
+    assert "pu.PiptUser_Id=%(user_id)s" in investigator_sql
+    assert investigator_params == dict(user_id=42, proposal_codes=["2019-1-SCI-002"])
+    tac_sql, tac_params = queries[1]
+    assert "partner.Partner_Code IN %(tacs)s" in tac_sql
+    assert "mp.ReqTimeAmount>0" in tac_sql
+    assert "pu.PiptUser_Id=%(user_id)s" not in tac_sql
+    assert tac_params == dict(tacs=["RSA"], proposal_codes=["2019-1-SCI-002"])
+
+    _assert_view_checks_agree(results, ["2019-1-SCI-001", "2019-1-SCI-002"])
+
+
+def test_connectable_reuses_engine_for_uri():
+    uri = "sqlite://"
+    engine = saltuser_module._connectable(uri)
+
+    assert engine is saltuser_module._connectable(uri)
+
+
+def test_connectable_returns_other_connectables_unchanged():
+    connection = FakeConnection([])
+
+    assert saltuser_module._connectable(connection) is connection
+
+
+def test_tac_chairs():
+    connection = FakeConnection(_user_results())
+    user = SALTUser(42, connection)
+
+    assert sorted(user.tacs) == ["RSA", "UW"]
+    assert user.is_tac_chair("RSA")
+    assert not user.is_tac_chair("UW")
+    tac_queries = [sql for sql, _ in connection.queries if "PiptUserTAC" in sql]
+    assert "Chair=1" in tac_queries[0]
+
+
+def test_ttl_cache_get_and_set():
+    cache = saltuser_module._TTLCache(maxsize=10, ttl=60)
+    cache["a"] = 1
+
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("b", 2) == 2
+
+
+def test_ttl_cache_expiry(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(saltuser_module.time, "monotonic", lambda: now[0])
+    cache = saltuser_module._TTLCache(maxsize=10, ttl=60)
+    cache["a"] = 1
+
+    now[0] += 59
+    assert cache.get("a") == 1
+
+    now[0] += 2
+    assert cache.get("a") is None
+
+
+def test_ttl_cache_maxsize_eviction():
+    cache = saltuser_module._TTLCache(maxsize=2, ttl=60)
+    cache["a"] = 1
+    cache["b"] = 2
+    cache["a"] = 3
+    cache["c"] = 4
+
+    # "b" is the least recently added entry
+    assert cache.get("b") is None
+    assert cache.get("a") == 3
+    assert cache.get("c") == 4
+
+
+def test_ttl_cache_pop_where_and_clear():
+    cache = saltuser_module._TTLCache(maxsize=10, ttl=60)
+    cache["a"] = 1
+    cache["b"] = 2
+    cache[("x", 1)] = 3
+    cache[("y", 2)] = 4
+
+    cache.pop_where(lambda key: isinstance(key, tuple) and key[1] == 1)
+    assert cache.get(("x", 1)) is None
+    assert cache.get(("y", 2)) == 4
+    assert cache.get("b") == 2
+
+    cache.clear()
+    assert cache.get("b") is None
+    assert cache.get(("y", 2)) is None
+
+
+def test_tac_partners_are_shared_between_users():
+    connection = FakeConnection(_user_results())
+    SALTUser(42, connection).is_tac_member("RSA")
+    SALTUser(42, connection).is_tac_member("RSA")
+
+    assert _query_count(connection, "FROM PiptUserTAC") == 1
+
+
+def test_shared_caches_distinguish_databases():
+    connection = FakeConnection(_user_results())
+    other_connection = FakeConnection(_user_results())
+    SALTUser(42, connection).is_proposal_tac_member("2019-1-SCI-001")
+    SALTUser(42, other_connection).is_proposal_tac_member("2019-1-SCI-001")
+
+    assert _query_count(other_connection, "FROM PiptUserTAC") == 1
+    assert _query_count(other_connection, "FROM Partner AS p") == 1
+
+
+def test_invalidate_cache_for_user():
+    connection = FakeConnection(_user_results())
+    SALTUser(42, connection).is_proposal_tac_member("2019-1-SCI-001")
+
+    SALTUser.invalidate_cache(user_id=42)
+    SALTUser(42, connection).is_proposal_tac_member("2019-1-SCI-001")
+
+    # the TACs are queried again, but the proposal partners are still cached
+    assert _query_count(connection, "FROM PiptUserTAC") == 2
+    assert _query_count(connection, "FROM Partner AS p") == 1
+
+
+def test_invalidate_cache_for_user_id_string():
+    connection = FakeConnection(_user_results())
+    SALTUser(42, connection).is_tac_member("RSA")
+
+    SALTUser.invalidate_cache(user_id="42")
+    SALTUser(42, connection).is_tac_member("RSA")
+
+    assert _query_count(connection, "FROM PiptUserTAC") == 2
+
+
+def test_database_key_for_garbage_collected_connection():
+    connection = FakeConnection([])
+    key = saltuser_module._database_key(connection)
+    del connection
+
+    assert key != saltuser_module._database_key(FakeConnection([]))
+
+
+def test_database_key_for_connection_without_weak_references():
+    assert saltuser_module._database_key(object()) is None
+
+
+def test_invalidate_cache():
+    connection = FakeConnection(_user_results())
+    SALTUser(42, connection).is_proposal_tac_member("2019-1-SCI-001")
+
+    SALTUser.invalidate_cache()
+    SALTUser(42, connection).is_proposal_tac_member("2019-1-SCI-001")
+
+    assert _query_count(connection, "FROM PiptUserTAC") == 2
+    assert _query_count(connection, "FROM Partner AS p") == 2
+
 
 def test_content():
     """Bogus test."""